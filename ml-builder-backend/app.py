@@ -1,22 +1,36 @@
 # app.py
+import hashlib
+import io
 import os
 import uuid
 import re
-import pickle
+import struct
+import tempfile
+import threading
+from dataclasses import asdict
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Optional
-from typing import Dict, Any
+from typing import Callable, Dict, Any, Set, Tuple
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, stream_with_context
 from flask_cors import CORS
+import numpy as np
+import orjson
 import pandas as pd
-from joblib import dump
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.ipc as paipc
+from joblib import dump, load, parallel_backend
 
 from ml_models.preprocessing import PreprocessorFactory, PreprocessConfig
 from ml_models.classifiers import (
     PerceptronModel,
     DecisionTreeModel,
     MLPBackpropModel,
+    prepare_split,
 )
+from ml_models._html import cm_to_html
 
 
 app = Flask(__name__)
@@ -24,9 +38,127 @@ CORS(app)  # allow React frontend to call the API
 
 os.makedirs("saved_models", exist_ok=True)
 
-# In-memory "session" store.
-# For a real deployment you'd move this to Redis / DB.
-SESSIONS: Dict[str, Dict[str, Any]] = {}
+# Largest accepted request body; Werkzeug rejects anything bigger with a 413.
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_UPLOAD_BYTES", 4 << 30))
+
+# In-memory "session" store, bounded so uploaded DataFrames don't stay pinned
+# for the process lifetime. Evicted sessions reload from Redis when enabled.
+SESSION_CACHE_MAX_ENTRIES = int(os.environ.get("SESSION_CACHE_MAX_ENTRIES", 32))
+SESSION_CACHE_MAX_BYTES = int(os.environ.get("SESSION_CACHE_MAX_BYTES", 2 << 30))
+
+
+def _array_nbytes(arr) -> int:
+    if hasattr(arr, "indptr"):  # scipy CSR/CSC from the one-hot encoder
+        return arr.data.nbytes + arr.indices.nbytes + arr.indptr.nbytes
+    return np.asarray(arr).nbytes
+
+
+def _session_nbytes(sess: Dict[str, Any]) -> int:
+    # dict.get so a lazily-loaded session isn't pulled from Redis just to be measured
+    frames = (dict.get(sess, f) for f in ("dataframe", "X", "y"))
+    # Series.memory_usage returns an int, DataFrame.memory_usage a per-column Series
+    total = sum(int(np.sum(f.memory_usage(deep=True))) for f in frames if f is not None)
+    split = dict.get(sess, "split")
+    if split is not None:
+        total += sum(_array_nbytes(split[k]) for k in ("X_train", "X_test", "y_train", "y_test"))
+    return total
+
+
+def _session_rows(sess: Dict[str, Any]) -> int:
+    for field in ("dataframe", "X"):
+        df = dict.get(sess, field)
+        if df is not None:
+            return int(df.shape[0])
+    return int(sess.get("num_rows", 0))
+
+
+def _release_spill_file(session_id: str, sess: Dict[str, Any]):
+    """Delete an evicted session's spilled upload.
+
+    In Redis mode a frame that isn't in Redis yet is copied there first; the
+    spill file is already in the Arrow IPC format _load_frame reads. The file
+    is kept if that copy fails.
+    """
+    path = dict.get(sess, "arrow_path")
+    if not path or not os.path.exists(path):
+        return
+    try:
+        if USE_REDIS and redis_client is not None and "dataframe" in sess:
+            key = _redis_key(session_id, "dataframe")
+            if not redis_client.exists(key):
+                with open(path, "rb") as f:
+                    redis_client.set(key, f.read())
+        os.remove(path)
+    except Exception:
+        app.logger.exception("Failed to release spilled upload %s", path)
+
+
+class SessionCache(OrderedDict):
+    """LRU of sessions capped by entry count and aggregate DataFrame bytes.
+
+    Request threads share it, so every access holds `lock`.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        super().__init__()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._nbytes: Dict[str, int] = {}
+        self.lock = threading.RLock()
+
+    def __getitem__(self, key):
+        with self.lock:
+            value = super().__getitem__(key)
+            self.move_to_end(key)
+            return value
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self[key] if key in self else default
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            super().__setitem__(key, value)
+            self.move_to_end(key)
+            self._nbytes[key] = _session_nbytes(value)
+        if isinstance(value, _LazySession):
+            # frames loaded later (from Redis or a spill file) count too
+            value.on_load = lambda: self.remeasure(key)
+        self._trim()
+
+    def __delitem__(self, key):
+        with self.lock:
+            super().__delitem__(key)
+            self._nbytes.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            super().clear()
+            self._nbytes.clear()
+
+    def remeasure(self, key: str):
+        with self.lock:
+            if key not in self:
+                return
+            self._nbytes[key] = _session_nbytes(super().__getitem__(key))
+        self._trim()
+
+    def _trim(self):
+        evicted = []
+        with self.lock:
+            # Never evict the most recent entry, even if it alone exceeds the budget.
+            while len(self) > 1 and (
+                len(self) > self.max_entries or sum(self._nbytes.values()) > self.max_bytes
+            ):
+                key, sess = self.popitem(last=False)
+                self._nbytes.pop(key, None)
+                evicted.append((key, sess))
+        # outside the lock: this may copy a whole upload to Redis
+        for key, sess in evicted:
+            _release_spill_file(key, sess)
+
+
+SESSIONS = SessionCache(SESSION_CACHE_MAX_ENTRIES, SESSION_CACHE_MAX_BYTES)
 
 # Redis client (optional). If `REDIS_URL` is set in the environment we will
 # persist sessions to Redis so they survive process/container restarts.
@@ -44,20 +176,445 @@ if os.environ.get("REDIS_URL"):
         USE_REDIS = False
 
 
+# Set KEEP_RAW_DATAFRAME=0 to drop the uploaded frame once /api/preprocess
+# has cached X and y; the session then holds only the feature/target data.
+KEEP_RAW_DATAFRAME = os.environ.get("KEEP_RAW_DATAFRAME", "1") == "1"
+
+# Default worker count for preprocessing/training; leave half the cores for
+# the web server. Clients can override it with `n_jobs` in the request body.
+DEFAULT_N_JOBS = max(1, (os.cpu_count() or 2) // 2)
+
+
+def _parse_n_jobs(value) -> int:
+    """Validate a client's `n_jobs`: -1 means every core, larger values are capped.
+
+    Each worker is a loky process, so the count must never exceed the CPUs.
+    """
+    cpus = os.cpu_count() or 1
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError("n_jobs must be an integer")
+    n_jobs = int(value)
+    if n_jobs == -1:
+        return cpus
+    if n_jobs < 1:
+        raise ValueError("n_jobs must be -1 or a positive integer")
+    return min(n_jobs, cpus)
+
+# CSV uploads are parsed by Arrow's multithreaded reader in 8MB blocks.
+CSV_READ_OPTIONS = pacsv.ReadOptions(block_size=8 << 20)
+
+# pd.read_csv's default NA markers. Arrow keeps empty string cells as '' by
+# default, which would hide missing targets and bypass the imputers.
+PANDAS_NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND",
+    "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+]
+CSV_CONVERT_OPTIONS = pacsv.ConvertOptions(null_values=PANDAS_NA_VALUES, strings_can_be_null=True)
+
+# CSV uploads bigger than this are streamed in 16MB batches to an Arrow IPC
+# file on disk and only loaded into pandas when preprocessing needs them.
+UPLOAD_SPILL_BYTES = int(os.environ.get("UPLOAD_SPILL_BYTES", 256 << 20))
+UPLOAD_SPILL_DIR = os.environ.get("UPLOAD_SPILL_DIR", tempfile.gettempdir())
+CSV_STREAM_OPTIONS = pacsv.ReadOptions(block_size=16 << 20)
+
+
+# Confusion matrices with more classes than this are streamed row by row.
+STREAM_MATRIX_MIN_CLASSES = 50
+
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
 # Helper functions
 
+def _orjson_default(obj):
+    # Values orjson can't encode natively (e.g. pandas Timestamps in a preview)
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    return str(obj)
+
+
+def _dumps(obj) -> bytes:
+    return orjson.dumps(obj, default=_orjson_default, option=ORJSON_OPTIONS)
+
+
+def _json_response(obj) -> Response:
+    """jsonify replacement backed by orjson."""
+    return app.response_class(_dumps(obj), mimetype="application/json")
+
+
+def _stream_matrix(cm):
+    """Yield a nested-list matrix as a JSON array, one row at a time."""
+    yield b"["
+    for i, row in enumerate(cm):
+        if i:
+            yield b","
+        yield _dumps(row)
+    yield b"]"
+
+
+def _stream_confusion_matrix_response(model_type: str, metrics: Dict[str, Any], cm, cm_html) -> Response:
+    """Streamed equivalent of the /api/confusion_matrix JSON payload.
+
+    The HTML table is the largest part, so it is sent once at the top level
+    rather than also inside "metrics".
+    """
+    metrics_head = {
+        k: v for k, v in metrics.items() if k not in ("confusion_matrix", "confusion_matrix_html")
+    }
+
+    def generate():
+        yield b'{"model_type":' + _dumps(model_type)
+        # re-open the metrics object to append its matrix
+        yield b',"metrics":' + _dumps(metrics_head)[:-1] + b',"confusion_matrix":'
+        yield from _stream_matrix(cm)
+        yield b'},"confusion_matrix":'
+        yield from _stream_matrix(cm)
+        yield b',"confusion_matrix_html":' + _dumps(cm_html) + b"}"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
+def _read_csv(stream) -> pd.DataFrame:
+    """Parse a CSV stream with pyarrow and hand back a pandas DataFrame."""
+    table = pacsv.read_csv(stream, read_options=CSV_READ_OPTIONS, convert_options=CSV_CONVERT_OPTIONS)
+    # self_destruct frees Arrow buffers column by column while converting,
+    # so we never hold two full copies of the data.
+    return table.to_pandas(self_destruct=True, split_blocks=True)
+
+
+def _spool_csv_to_arrow(stream, path: str) -> Tuple[pd.DataFrame, int]:
+    """Stream a CSV into an Arrow IPC file batch by batch.
+
+    Returns the first rows (for the preview) and the total row count.
+    """
+    try:
+        reader = pacsv.open_csv(
+            stream, read_options=CSV_STREAM_OPTIONS, convert_options=CSV_CONVERT_OPTIONS
+        )
+        head = None
+        num_rows = 0
+        with pa.OSFile(path, "wb") as sink, paipc.new_file(sink, reader.schema) as writer:
+            for batch in reader:
+                if head is None:
+                    head = batch.slice(0, 5).to_pandas()
+                writer.write_batch(batch)
+                num_rows += batch.num_rows
+        if head is None:
+            head = reader.schema.empty_table().to_pandas()
+        return head, num_rows
+    except pa.ArrowInvalid:
+        # open_csv fixes column types from the first block, so a column that
+        # changes type later (ints, then 1.5 or text) fails. read_csv infers
+        # types over the whole file; it costs one full table in memory.
+        stream.seek(0)
+        table = pacsv.read_csv(stream, read_options=CSV_READ_OPTIONS, convert_options=CSV_CONVERT_OPTIONS)
+        with pa.OSFile(path, "wb") as sink, paipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        return table.slice(0, 5).to_pandas(), table.num_rows
+
+
+def _read_arrow_file(path: str) -> pd.DataFrame:
+    """Load a spilled upload; the file is memory-mapped rather than read."""
+    table = paipc.open_file(pa.memory_map(path)).read_all()
+    return _downcast(table.to_pandas(split_blocks=True))
+
+
+def _read_ipc_head(source, n: int) -> pd.DataFrame:
+    """First n rows of an Arrow IPC file; later record batches aren't converted."""
+    reader = paipc.open_file(source)
+    if reader.num_record_batches == 0:
+        return reader.schema.empty_table().to_pandas()
+    return reader.get_batch(0).slice(0, n).to_pandas()
+
+
+def _preview_records(df: pd.DataFrame, n: int = 5):
+    # Build the records from the n-row slice directly; to_dict(orient="records")
+    # walks every block of the frame, which is slow for wide datasets.
+    head = df.head(n)
+    float32_cols = [c for c, dtype in head.dtypes.items() if dtype == np.float32]
+    if float32_cols:
+        # Columns _downcast narrowed to float32 would come back as e.g.
+        # 0.10000000149011612; round-trip through the shortest float32 repr.
+        head = head.copy()
+        for col in float32_cols:
+            head[col] = [float(str(v)) for v in head[col].to_numpy()]
+    return [dict(zip(head.columns, row)) for row in head.itertuples(index=False, name=None)]
+
+
+def _session_dataframe(sess: Dict[str, Any]) -> pd.DataFrame:
+    """The session's dataset, rebuilt from X and y if the raw frame was dropped."""
+    df = sess.get("dataframe")
+    if df is None:
+        df = pd.concat([sess["X"], sess["y"]], axis=1)
+    return df
+
+
+def _downcast(df: pd.DataFrame) -> pd.DataFrame:
+    """Shrink column dtypes: strings to category, numbers to the narrowest fit.
+
+    Halves the stored frame for typical datasets, and the encoders read
+    category codes instead of hashing Python strings.
+    """
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series):
+            df[col] = series.astype("category")
+        elif pd.api.types.is_float_dtype(series):
+            df[col] = pd.to_numeric(series, downcast="float")
+        elif pd.api.types.is_integer_dtype(series):
+            df[col] = pd.to_numeric(series, downcast="integer")
+    return df
+
+
+_HIDDEN_SPLIT_RE = re.compile(r"[,;\s]+")
+
+
+def _parse_hidden_layers(value, num_layers_val=None, neurons_val=None, _re=_HIDDEN_SPLIT_RE):
+    """Accept several ways for users to specify the hidden layers:
+
+    - hidden_layers: list of ints, e.g. [64, 32]
+    - hidden_layers: comma-separated string, e.g. "64,32"
+    - hidden_layers: single int (one hidden layer)
+    - num_layers + neurons: e.g. num_layers=3, neurons=32 -> (32,32,32)
+    """
+    # If an explicit hidden_layers value is provided, parse it.
+    if value is not None:
+        # list -> convert elements to ints
+        if isinstance(value, list):
+            arr = [int(x) for x in value]
+        # string -> split on commas, semicolons or whitespace
+        elif isinstance(value, str):
+            parts = [p for p in _re.split(value.strip()) if p]
+            if not parts:
+                raise ValueError("hidden_layers string empty")
+            arr = [int(p) for p in parts]
+        # single int
+        elif isinstance(value, int):
+            arr = [int(value)]
+        else:
+            raise ValueError("Unsupported hidden_layers format; use list, CSV string, or int")
+
+        if any(x <= 0 for x in arr):
+            raise ValueError("All hidden layer sizes must be positive integers")
+
+        return tuple(arr)
+
+    # Fallback to num_layers + neurons if provided
+    if num_layers_val is not None and neurons_val is not None:
+        n_layers = int(num_layers_val)
+        n_neurons = int(neurons_val)
+        if n_layers <= 0 or n_neurons <= 0:
+            raise ValueError("num_layers and neurons must be positive integers")
+        return tuple([n_neurons] * n_layers)
+
+    # Default
+    return (100,)
+
+
+# Redis layout: each large session value gets its own key so a request only
+# re-serializes what it touched.
+#   session:{id}:meta          small values, see _serialize_session
+#   session:{id}:<frame>       Arrow IPC bytes for dataframe / X / y
+#   session:{id}:split         joblib dump of the prepare_split() result
+#   session:{id}:model:<type>  joblib dump of a fitted pipeline
+FRAME_FIELDS = ("dataframe", "X", "y")
+SERIES_FIELDS = ("y",)
+ARRAY_FIELDS = ("split",)
+BLOB_FIELDS = FRAME_FIELDS + ARRAY_FIELDS
+
+
+class _LazySession(dict):
+    """dict whose missing keys are filled from a loader on first access."""
+
+    def __init__(self, data: Dict[str, Any], loaders: Dict[str, Callable[[], Any]]):
+        super().__init__(data)
+        self._loaders = dict(loaders)
+        # called after each load; SessionCache uses it to re-measure the session
+        self.on_load: Optional[Callable[[], None]] = None
+
+    def __missing__(self, key):
+        loader = self._loaders.pop(key, None)
+        if loader is None:
+            raise KeyError(key)
+        value = loader()
+        dict.__setitem__(self, key, value)
+        if self.on_load is not None:
+            self.on_load()
+        return value
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self._loaders
+
+    def __setitem__(self, key, value):
+        self._loaders.pop(key, None)
+        dict.__setitem__(self, key, value)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        self._loaders.pop(key, None)
+        return dict.pop(self, key, *default)
+
+
+def _redis_key(session_id: str, part: str) -> str:
+    return f"session:{session_id}:{part}"
+
+
+def _dump_frame(value) -> bytes:
+    if isinstance(value, pd.Series):
+        value = value.to_frame()
+    table = pa.Table.from_pandas(value)
+    sink = pa.BufferOutputStream()
+    with paipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _load_frame(raw: bytes, field: str):
+    # py_buffer wraps the Redis bytes without copying them
+    df = paipc.open_file(pa.py_buffer(raw)).read_all().to_pandas()
+    if field == "dataframe":
+        # may be a raw spill file copied by _release_spill_file
+        df = _downcast(df)
+    return df.iloc[:, 0] if field in SERIES_FIELDS else df
+
+
+def _dump_joblib(obj) -> bytes:
+    buf = io.BytesIO()
+    dump(obj, buf, compress=3)
+    return buf.getvalue()
+
+
+def _load_joblib(raw: bytes):
+    return load(io.BytesIO(raw))
+
+
+def _decode_field(raw: bytes, field: str):
+    return _load_joblib(raw) if field in ARRAY_FIELDS else _load_frame(raw, field)
+
+
+def _fetch(
+    session_id: str,
+    part: str,
+    decode: Callable[[bytes], Any],
+    fallback: Optional[Callable[[], Any]] = None,
+) -> Callable[[], Any]:
+    """Build a loader that reads and decodes one session sub-key from Redis."""
+
+    def loader():
+        raw = redis_client.get(_redis_key(session_id, part))
+        if raw is None:
+            if fallback is not None:
+                return fallback()
+            raise KeyError(f"Session data '{part}' missing from Redis.")
+        return decode(raw)
+
+    return loader
+
+
+def _session_meta(sess: Dict[str, Any]) -> Dict[str, Any]:
+    meta = {k: v for k, v in sess.items() if k not in BLOB_FIELDS and k != "models"}
+    meta["models"] = {
+        t: {k: v for k, v in info.items() if k != "pipeline"} for t, info in sess.get("models", {}).items()
+    }
+    meta["blobs"] = [f for f in BLOB_FIELDS if f in sess]
+    return meta
+
+
+# Meta values that are sklearn objects rather than plain JSON data.
+OBJECT_FIELDS = ("preprocessor",)
+
+
+def _serialize_session(sess: Dict[str, Any]) -> bytes:
+    """Encode a session's meta as length-prefixed parts.
+
+    Part 1 is JSON (config, column lists, metrics); part 2 is a joblib dump of
+    the few sklearn objects. Frames, the prepared split and pipelines live under
+    their own keys (see _persist_session).
+    """
+    meta = _session_meta(sess)
+    objects = {f: meta.pop(f) for f in OBJECT_FIELDS if f in meta}
+    if meta.get("preprocess_config") is not None:
+        meta["preprocess_config"] = asdict(meta["preprocess_config"])
+    parts = (_dumps(meta), _dump_joblib(objects))
+    return b"".join(struct.pack(">Q", len(p)) + p for p in parts)
+
+
+def _deserialize_session(raw: bytes) -> Dict[str, Any]:
+    view = memoryview(raw)
+    parts = []
+    offset = 0
+    while offset < len(view):
+        (size,) = struct.unpack_from(">Q", view, offset)
+        offset += 8
+        parts.append(view[offset:offset + size])
+        offset += size
+    meta_part, objects_part = parts
+
+    meta = orjson.loads(meta_part)
+    meta.update(_load_joblib(objects_part))
+    if meta.get("preprocess_config") is not None:
+        meta["preprocess_config"] = PreprocessConfig(**meta["preprocess_config"])
+    return meta
+
+
+def _load_session(session_id: str, raw_meta: bytes) -> Dict[str, Any]:
+    """Rebuild a session from its Redis meta; frames and pipelines load lazily."""
+    meta = _deserialize_session(raw_meta)
+    blobs = meta.pop("blobs", [])
+    models = {
+        t: _LazySession(info, {"pipeline": _fetch(session_id, f"model:{t}", _load_joblib)})
+        for t, info in meta.pop("models", {}).items()
+    }
+    loaders = {f: _fetch(session_id, f, lambda raw, f=f: _decode_field(raw, f)) for f in blobs}
+    arrow_path = meta.get("arrow_path")
+    if arrow_path and "dataframe" in loaders:
+        # A spilled upload is only written to Redis once it has been modified.
+        loaders["dataframe"] = _fetch(
+            session_id, "dataframe", lambda raw: _load_frame(raw, "dataframe"),
+            fallback=lambda: _read_arrow_file(arrow_path),
+        )
+    return _LazySession({**meta, "models": models}, loaders)
+
+
+def _session_head(session_id: str, sess: Dict[str, Any], field: str, n: int = 5):
+    """First n rows of a session frame without loading the whole of it.
+
+    A frame not in memory yet is read from its spill file or Redis value
+    directly instead of going through the session's lazy loader.
+    """
+    value = dict.get(sess, field)
+    if value is not None:
+        return value.head(n)
+    if field not in sess:
+        return None
+    arrow_path = dict.get(sess, "arrow_path")
+    if field == "dataframe" and arrow_path and os.path.exists(arrow_path):
+        return _read_ipc_head(pa.memory_map(arrow_path), n)
+    if USE_REDIS and redis_client is not None:
+        raw = redis_client.get(_redis_key(session_id, field))
+        if raw is not None:
+            head = _read_ipc_head(pa.py_buffer(raw), n)
+            return head.iloc[:, 0] if field in SERIES_FIELDS else head
+    return sess[field].head(n)
+
+
 def get_session(session_id: str) -> Dict[str, Any]:
     # First check local in-memory cache
-    if session_id in SESSIONS:
-        return SESSIONS[session_id]
+    sess = SESSIONS.get(session_id)
+    if sess is not None:
+        return sess
 
     # Fall back to Redis if configured
     if USE_REDIS and redis_client is not None:
-        key = f"session:{session_id}"
-        raw = redis_client.get(key)
+        raw = redis_client.get(_redis_key(session_id, "meta"))
         if raw:
             try:
-                sess = pickle.loads(raw)
+                sess = _load_session(session_id, raw)
                 # Populate in-memory cache for faster subsequent access
                 SESSIONS[session_id] = sess
                 return sess
@@ -68,15 +625,85 @@ def get_session(session_id: str) -> Dict[str, Any]:
     raise KeyError("Invalid session_id. Upload a dataset first.")
 
 
-def _persist_session(session_id: str, sess: Dict[str, Any]):
-    """Persist session to Redis if enabled (also keep in-memory copy)."""
+def _persist_session(session_id: str, sess: Dict[str, Any], dirty: Optional[Set[str]] = None) -> bool:
+    """Persist session to Redis if enabled (also keep in-memory copy).
+
+    `dirty` names the parts that changed: "meta", a blob field ("dataframe",
+    "X", "y", "split") or "model:<type>". Only those are re-serialized; None writes
+    everything. Returns False if the Redis write failed (it is only logged).
+    """
     SESSIONS[session_id] = sess
-    if USE_REDIS and redis_client is not None:
-        key = f"session:{session_id}"
-        try:
-            redis_client.set(key, pickle.dumps(sess))
-        except Exception:
-            app.logger.exception("Failed to persist session to Redis")
+    if not (USE_REDIS and redis_client is not None):
+        return True
+
+    if dirty is None:
+        dirty = {"meta", *(f for f in BLOB_FIELDS if f in sess)}
+        dirty.update(f"model:{t}" for t in sess.get("models", {}))
+
+    try:
+        pipe = redis_client.pipeline()
+        for part in dirty:
+            key = _redis_key(session_id, part)
+            if part == "meta":
+                pipe.set(key, _serialize_session(sess))
+            elif part in BLOB_FIELDS:
+                value = sess.get(part)
+                if value is None:
+                    pipe.delete(key)
+                elif part in ARRAY_FIELDS:
+                    pipe.set(key, _dump_joblib(value))
+                else:
+                    pipe.set(key, _dump_frame(value))
+            elif part.startswith("model:"):
+                model_type = part.split(":", 1)[1]
+                pipe.set(key, _dump_joblib(sess["models"][model_type]["pipeline"]))
+        pipe.execute()
+    except Exception:
+        app.logger.exception("Failed to persist session to Redis")
+        return False
+    return True
+
+
+@lru_cache(maxsize=1024)
+def _confusion_matrix_etag(session_id: str, model_type: str, fmt: str, version: str) -> str:
+    """ETag for /api/confusion_matrix.
+
+    `version` is the token /api/train stores with each trained model, so a
+    retrain that reproduces the same matrix (but not the same metrics) still
+    gets a new tag. Only the tag is cached: bodies would pin memory for
+    sessions the LRU has already evicted.
+    """
+    cm = get_session(session_id)["models"][model_type]["metrics"].get("confusion_matrix")
+    cm_arr = np.asarray(cm or [], dtype=np.int64)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(version.encode())
+    digest.update(repr(cm_arr.shape).encode())
+    digest.update(cm_arr.tobytes())
+    digest.update(fmt.encode())
+    return digest.hexdigest()
+
+
+def _confusion_matrix_body(model_type: str, metrics: Dict[str, Any], fmt: str) -> Optional[bytes]:
+    """JSON body for /api/confusion_matrix, or None when the matrix is large
+    enough to be streamed instead."""
+    # If HTML version isn't present, try to build a simple one from the matrix
+    cm = metrics.get("confusion_matrix")
+    cm_html = metrics.get("confusion_matrix_html")
+
+    if not cm_html and cm:
+        # keep it on the stored metrics so the streamed response can use it
+        cm_html = metrics["confusion_matrix_html"] = cm_to_html(cm)
+
+    if fmt == "html":
+        return _dumps({"confusion_matrix_html": cm_html or ""})
+    if cm and len(cm) > STREAM_MATRIX_MIN_CLASSES:
+        return None
+
+    # Response includes both JSON matrix and HTML for convenience
+    resp = {"model_type": model_type, "metrics": metrics}
+    resp["confusion_matrix"] = cm
+    resp["confusion_matrix_html"] = cm_html
+    return _dumps(resp)
 
 
 # 1) Upload dataset
@@ -88,42 +715,70 @@ def upload_dataset():
     Returns: preview (first 5 rows), num_rows, num_cols, columns
     """
     if "file" not in request.files:
-        return jsonify({"error": "No file part named 'file' in request."}), 400
+        return _json_response({"error": "No file part named 'file' in request."}), 400
 
     file = request.files["file"]
     if file.filename == "":
-        return jsonify({"error": "No selected file."}), 400
+        return _json_response({"error": "No selected file."}), 400
 
     filename = file.filename.lower()
-    try:
-        if filename.endswith(".csv"):
-            df = pd.read_csv(file)
-        else:
-            # read as Excel by default if not CSV
-            df = pd.read_excel(file)
-    except Exception as e:
-        return jsonify({"error": f"Failed to read file: {e}"}), 400
-
-    # Create new session
     session_id = str(uuid.uuid4())
     sess = {
-        "dataframe": df,
         "preprocess_config": None,
         "preprocessor": None,
         "models": {},  # model_type -> { pipeline, metrics }
     }
-    _persist_session(session_id, sess)
-
-    preview_rows = df.head(5).to_dict(orient="records")
-    num_rows, num_cols = df.shape
-
-    return jsonify(
+    spill = filename.endswith(".csv") and (request.content_length or 0) > UPLOAD_SPILL_BYTES
+    try:
+        if spill:
+            # Large CSV: stream it to disk and defer the pandas conversion.
+            arrow_path = os.path.join(UPLOAD_SPILL_DIR, f"session_{session_id}.arrow")
+            try:
+                preview_df, num_rows = _spool_csv_to_arrow(file.stream, arrow_path)
+            except Exception:
+                if os.path.exists(arrow_path):
+                    os.remove(arrow_path)
+                raise
+            sess = _LazySession(
+                {**sess, "arrow_path": arrow_path, "num_rows": num_rows},
+                {"dataframe": lambda: _read_arrow_file(arrow_path)},
+            )
+        elif filename.endswith(".csv"):
+            df = _read_csv(file.stream)
+        else:
+            # read as Excel by default if not CSV
+            df = pd.read_excel(file, engine="calamine")
+    except Exception as e:
+        return _json_response({"error": f"Failed to read file: {e}"}), 400
+
+    if not spill:
+        df = _downcast(df)
+        num_rows = df.shape[0]
+        sess["dataframe"] = df
+        # kept in meta so row counts don't need the frame (e.g. Redis-backed sessions)
+        sess["num_rows"] = num_rows
+        preview_df = df
+
+    # Column dtypes never change after upload, so classify them once here;
+    # /api/preprocess can then be re-run without walking the frame again.
+    # (A spilled upload's preview carries the same Arrow-derived dtypes.)
+    sess["_dtype_split"] = PreprocessorFactory.split_dtypes(preview_df)
+    # Upload column order, so /api/dataframe_preview can restore it from X/y
+    sess["columns"] = list(preview_df.columns)
+
+    # A spilled upload only writes metadata; the data stays in the Arrow file.
+    _persist_session(session_id, sess, {"meta"} if spill else None)
+
+    preview_rows = _preview_records(preview_df)
+    num_cols = preview_df.shape[1]
+
+    return _json_response(
         {
             "session_id": session_id,
             "preview": preview_rows,
             "num_rows": int(num_rows),
             "num_cols": int(num_cols),
-            "columns": list(df.columns),
+            "columns": list(preview_df.columns),
         }
     )
 
@@ -137,7 +792,9 @@ def preprocess_data():
     {
       "session_id": "...",
       "method": "normalization" | "onehot",
-      "target_column": "label"
+      "target_column": "label",
+      // Optional: worker processes for the ColumnTransformer
+      "n_jobs": 4
     }
     """
     data = request.get_json(force=True)
@@ -146,14 +803,21 @@ def preprocess_data():
         method = data["method"]
         target_column = data["target_column"]
     except KeyError as e:
-        return jsonify({"error": f"Missing field: {e}"}), 400
+        return _json_response({"error": f"Missing field: {e}"}), 400
+
+    try:
+        n_jobs = _parse_n_jobs(data.get("n_jobs", DEFAULT_N_JOBS))
+    except ValueError as e:
+        return _json_response({"error": f"Invalid n_jobs: {e}"}), 400
 
     try:
         sess = get_session(session_id)
-        df = sess["dataframe"]
+        df = _session_dataframe(sess)
 
-        config: PreprocessConfig = PreprocessorFactory.analyze_dataframe(df, target_column)
-        preprocessor, config = PreprocessorFactory.build(config, method)
+        config: PreprocessConfig = PreprocessorFactory.analyze_dataframe(
+            df, target_column, precomputed=sess.get("_dtype_split")
+        )
+        preprocessor, config = PreprocessorFactory.build(config, method, n_jobs=n_jobs)
 
         X = df[config.feature_columns]
         y = df[target_column]
@@ -164,13 +828,19 @@ def preprocess_data():
         # were removed and log a warning for the user.
         n_missing = int(y.isnull().sum())
         dropped_rows = 0
+        dirty = {"meta", "X", "y", "split"}
         if n_missing > 0:
-            mask = ~y.isnull()
-            X = X.loc[mask].reset_index(drop=True)
-            y = y.loc[mask].reset_index(drop=True)
+            # One positional take of the whole frame, then slice X and y from it
+            # (rather than three separate boolean-mask copies).
+            idx = np.flatnonzero(~y.isna().to_numpy())
+            df = df.take(idx)
+            df.index = pd.RangeIndex(len(df))  # metadata only; no second copy
+            X = df[config.feature_columns]
+            y = df[target_column]
             # Optionally update the stored dataframe to the cleaned version
-            df = df.loc[mask].reset_index(drop=True)
             sess["dataframe"] = df
+            dirty.add("dataframe")
+            sess["num_rows"] = len(df)
             dropped_rows = n_missing
             app.logger.warning("Dropped %d rows with missing target '%s'", dropped_rows, target_column)
 
@@ -178,8 +848,29 @@ def preprocess_data():
         sess["preprocessor"] = preprocessor
         sess["X"] = X
         sess["y"] = y
+        # Any split prepared for the previous configuration is stale now
+        sess.pop("split", None)
+        if not KEEP_RAW_DATAFRAME:
+            # X and y hold everything training needs; the full frame can go.
+            sess.pop("dataframe", None)
+            dirty.add("dataframe")  # deletes the Redis copy
+        # A spilled upload is in memory now; persist it (or its removal) to
+        # Redis below.
+        spill_path = dict.get(sess, "arrow_path")
+        if spill_path:
+            dirty.add("dataframe")
         # Persist session after modifications
-        _persist_session(session_id, sess)
+        stored = _persist_session(session_id, sess, dirty)
+        if spill_path and stored:
+            # Only once the frame is in Redis can the session stop pointing at
+            # the file; until then it is the copy a reload falls back to (e.g.
+            # when the frame is over Redis' 512 MB value limit).
+            sess.pop("arrow_path")
+            if _persist_session(session_id, sess, {"meta"}):
+                if os.path.exists(spill_path):
+                    os.remove(spill_path)
+            else:
+                sess["arrow_path"] = spill_path
 
         summary = {
             "method": config.method,
@@ -192,9 +883,9 @@ def preprocess_data():
         if dropped_rows:
             summary["dropped_rows_with_missing_target"] = int(dropped_rows)
 
-        return jsonify({"message": "Preprocessing configured.", "summary": summary})
+        return _json_response({"message": "Preprocessing configured.", "summary": summary})
     except Exception as e:
-        return jsonify({"error": str(e)}), 400
+        return _json_response({"error": str(e)}), 400
 
 
 # 3) Train classification model
@@ -206,12 +897,14 @@ def train_model():
     {
       "session_id": "...",
       "model_type": "perceptron" | "decision_tree" | "mlp",
-      // Optional general param:
+      // Optional general params:
       "test_size": 0.3,
+      "n_jobs": 4,
       // For MLP:
       "learning_rate": 0.001,
       "hidden_layers": [32, 16],
-      "max_iter": 300
+      "max_iter": 300,
+      "backend": "sklearn" | "torch"
     }
     """
     data = request.get_json(force=True)
@@ -219,64 +912,29 @@ def train_model():
         session_id = data["session_id"]
         model_type = data["model_type"].lower()
     except KeyError as e:
-        return jsonify({"error": f"Missing field: {e}"}), 400
+        return _json_response({"error": f"Missing field: {e}"}), 400
 
     test_size = float(data.get("test_size", 0.2))
+    try:
+        n_jobs = _parse_n_jobs(data.get("n_jobs", DEFAULT_N_JOBS))
+    except ValueError as e:
+        return _json_response({"error": f"Invalid n_jobs: {e}"}), 400
 
     try:
         sess = get_session(session_id)
 
         if sess.get("preprocessor") is None:
-            return jsonify({"error": "Preprocessing not configured yet."}), 400
+            return _json_response({"error": "Preprocessing not configured yet."}), 400
 
         X = sess["X"]
         y = sess["y"]
         preprocessor = sess["preprocessor"]
 
         if model_type == "perceptron":
-            model = PerceptronModel()
+            model = PerceptronModel(n_jobs=n_jobs)
         elif model_type == "decision_tree":
-            model = DecisionTreeModel()
+            model = DecisionTreeModel(n_jobs=n_jobs)
         elif model_type in ("mlp", "multilayer_perceptron", "backpropagation"):
-            # Accept several ways for users to specify the hidden layers:
-            # - hidden_layers: list of ints, e.g. [64, 32]
-            # - hidden_layers: comma-separated string, e.g. "64,32"
-            # - hidden_layers: single int (one hidden layer)
-            # - num_layers + neurons: e.g. num_layers=3, neurons=32 -> (32,32,32)
-            def _parse_hidden_layers(value, num_layers_val=None, neurons_val=None):
-                # If an explicit hidden_layers value is provided, parse it.
-                if value is not None:
-                    # list -> convert elements to ints
-                    if isinstance(value, list):
-                        arr = [int(x) for x in value]
-                    # string -> split on commas, semicolons or whitespace
-                    elif isinstance(value, str):
-                        parts = [p for p in re.split(r"[,;\s]+", value.strip()) if p]
-                        if not parts:
-                            raise ValueError("hidden_layers string empty")
-                        arr = [int(p) for p in parts]
-                    # single int
-                    elif isinstance(value, int):
-                        arr = [int(value)]
-                    else:
-                        raise ValueError("Unsupported hidden_layers format; use list, CSV string, or int")
-
-                    if any(x <= 0 for x in arr):
-                        raise ValueError("All hidden layer sizes must be positive integers")
-
-                    return tuple(arr)
-
-                # Fallback to num_layers + neurons if provided
-                if num_layers_val is not None and neurons_val is not None:
-                    n_layers = int(num_layers_val)
-                    n_neurons = int(neurons_val)
-                    if n_layers <= 0 or n_neurons <= 0:
-                        raise ValueError("num_layers and neurons must be positive integers")
-                    return tuple([n_neurons] * n_layers)
-
-                # Default
-                return (100,)
-
             hidden_input = data.get("hidden_layers")
             # Accept either 'neurons' or commonly misspelled 'nuearals'
             neurons_input = data.get("neurons") or data.get("nuearals")
@@ -284,38 +942,57 @@ def train_model():
             try:
                 hidden_layers = _parse_hidden_layers(hidden_input, num_layers_input, neurons_input)
             except Exception as e:
-                return jsonify({"error": f"Invalid hidden_layers: {e}"}), 400
+                return _json_response({"error": f"Invalid hidden_layers: {e}"}), 400
 
             learning_rate = float(data.get("learning_rate", 0.001))
             max_iter = int(data.get("max_iter", 300))
+            backend = str(data.get("backend", "sklearn")).lower()
             model = MLPBackpropModel(
                 hidden_layer_sizes=hidden_layers,
                 learning_rate_init=learning_rate,
                 max_iter=max_iter,
+                n_jobs=n_jobs,
+                backend=backend,
             )
         else:
-            return jsonify({"error": "Unknown model_type"}), 400
+            return _json_response({"error": "Unknown model_type"}), 400
+
+        # Fit the preprocessor on the training rows once per test_size and
+        # reuse the transformed split, so repeated /api/train calls (e.g.
+        # hyperparameter sweeps) only fit the classifier.
+        dirty = {"meta", f"model:{model_type}"}
+        split = sess.get("split")
+        if split is None or split["test_size"] != test_size:
+            with parallel_backend("loky", n_jobs=n_jobs):
+                split = prepare_split(X, y, preprocessor, test_size=test_size)
+            sess["split"] = split
+            dirty.add("split")
 
         pipeline, result = model.train_and_evaluate(
-            X=X, y=y, preprocessor=preprocessor, test_size=test_size
+            X=X, y=y, preprocessor=preprocessor, test_size=test_size, prepared=split
         )
 
+        metrics = result.to_dict()
         # store in session so it can be saved later
-        sess["models"][model_type] = {"pipeline": pipeline, "metrics": result.to_dict()}
+        sess["models"][model_type] = {
+            "pipeline": pipeline,
+            "metrics": metrics,
+            "version": uuid.uuid4().hex,  # keys the confusion-matrix response cache
+        }
         # Persist updated session
-        _persist_session(session_id, sess)
+        _persist_session(session_id, sess, dirty)
 
-        return jsonify(
+        return _json_response(
             {
                 "message": "Model trained successfully.",
                 "model_type": model_type,
-                "metrics": result.to_dict(),
+                "metrics": metrics,
                # "confusion_matrix": result.cm.tolist(),
             }
         )
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 400
+        return _json_response({"error": str(e)}), 400
 
 
 
@@ -330,54 +1007,36 @@ def get_confusion_matrix():
     fmt = (request.args.get("format") or "json").lower()
 
     if not session_id or not model_type:
-        return jsonify({"error": "Missing session_id or model_type query parameter."}), 400
+        return _json_response({"error": "Missing session_id or model_type query parameter."}), 400
 
     try:
         sess = get_session(session_id)
         model_info = sess.get("models", {}).get(model_type)
         if not model_info:
-            return jsonify({"error": "No trained model of this type for this session."}), 400
+            return _json_response({"error": "No trained model of this type for this session."}), 400
 
         metrics = model_info.get("metrics", {})
+        etag = _confusion_matrix_etag(session_id, model_type, fmt, model_info.get("version", ""))
 
-        # If HTML version isn't present, try to build a simple one from the matrix
-        cm = metrics.get("confusion_matrix")
-        cm_html = metrics.get("confusion_matrix_html")
-
-        def _build_html_from_cm(cm_list):
-            if not cm_list:
-                return ""
-            try:
-                n = len(cm_list)
-            except Exception:
-                return ""
-            headers = [f"Pred_{i}" for i in range(n)]
-            html = "<table class='confusion-matrix' border='1' cellspacing='0' cellpadding='4'>"
-            html += "<thead><tr><th></th>"
-            for h in headers:
-                html += f"<th>{h}</th>"
-            html += "</tr></thead><tbody>"
-            for i, row in enumerate(cm_list):
-                html += f"<tr><th>Actual_{i}</th>"
-                for v in row:
-                    html += f"<td>{int(v)}</td>"
-                html += "</tr>"
-            html += "</tbody></table>"
-            return html
-
-        if not cm_html and cm:
-            cm_html = _build_html_from_cm(cm)
-
-        # Response includes both JSON matrix and HTML for convenience
-        resp = {"model_type": model_type, "metrics": metrics}
-        if fmt == "html":
-            return jsonify({"confusion_matrix_html": cm_html or ""})
-        resp["confusion_matrix"] = cm
-        resp["confusion_matrix_html"] = cm_html
-        return jsonify(resp)
+        if request.if_none_match.contains(etag):
+            resp = app.response_class(status=304)
+        else:
+            body = _confusion_matrix_body(model_type, metrics, fmt)
+            if body is None:
+                resp = _stream_confusion_matrix_response(
+                    model_type, metrics, metrics.get("confusion_matrix"), metrics.get("confusion_matrix_html")
+                )
+            else:
+                resp = app.response_class(body, mimetype="application/json")
+
+        resp.set_etag(etag)
+        # Clients may keep the body but must revalidate: retraining the same
+        # model type replaces the matrix behind the same URL.
+        resp.headers["Cache-Control"] = "private, no-cache"
+        return resp
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 400
+        return _json_response({"error": str(e)}), 400
 
 
 
@@ -399,32 +1058,77 @@ def save_model():
         model_type = data["model_type"].lower()
         model_name = data["model_name"]
     except KeyError as e:
-        return jsonify({"error": f"Missing field: {e}"}), 400
+        return _json_response({"error": f"Missing field: {e}"}), 400
 
     try:
         sess = get_session(session_id)
         model_info = sess["models"].get(model_type)
 
         if not model_info:
-            return jsonify({"error": "No trained model of this type for this session."}), 400
+            return _json_response({"error": "No trained model of this type for this session."}), 400
 
         pipeline = model_info["pipeline"]
         safe_name = "".join(c for c in model_name if c.isalnum() or c in ("_", "-"))
         path = os.path.join("saved_models", f"{safe_name}.joblib")
 
-        dump(pipeline, path)
+        # LZ4 is much cheaper than zlib at similar ratios; protocol 5 writes
+        # numpy buffers out-of-band. Write to a temp file and rename so a
+        # concurrent reader never sees a partial model.
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            dump(pipeline, tmp_path, compress=("lz4", 3), protocol=5)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
 
-        return jsonify({"message": "Model saved.", "path": path})
+        return _json_response({"message": "Model saved.", "path": path})
     except Exception as e:
-        return jsonify({"error": str(e)}), 400
+        return _json_response({"error": str(e)}), 400
+
+
+@app.route("/api/dataframe_preview", methods=["GET"])
+def dataframe_preview():
+    """Preview of a session's dataset (same shape as the /api/upload response).
+
+    Works after the raw frame was dropped (KEEP_RAW_DATAFRAME=0) by joining
+    the first rows of X and y in upload column order; columns left out of
+    the feature selection are then missing.
+
+    Query params: ?session_id=...
+    """
+    session_id = request.args.get("session_id")
+    if not session_id:
+        return _json_response({"error": "Missing session_id query parameter."}), 400
+
+    try:
+        sess = get_session(session_id)
+        head = _session_head(session_id, sess, "dataframe")
+        if head is None:
+            head = pd.concat(
+                [_session_head(session_id, sess, "X"), _session_head(session_id, sess, "y")], axis=1
+            )
+            head = head[[c for c in sess.get("columns", head.columns) if c in head.columns]]
 
+        return _json_response(
+            {
+                "session_id": session_id,
+                "preview": _preview_records(head),
+                "num_rows": _session_rows(sess),
+                "num_cols": int(head.shape[1]),
+                "columns": list(head.columns),
+            }
+        )
+    except Exception as e:
+        return _json_response({"error": str(e)}), 400
 
 
 # 5) Simple health check
 
 @app.route("/api/health", methods=["GET"])
 def health():
-    return jsonify({"status": "ok"})
+    return _json_response({"status": "ok"})
 
 
 @app.route("/api/debug/sessions", methods=["GET"])
@@ -437,40 +1141,38 @@ def debug_sessions():
     """
     allow = app.debug or os.environ.get("ALLOW_DEBUG_SESSIONS", "0") == "1"
     if not allow:
-        return jsonify({"error": "Debug sessions endpoint not allowed."}), 403
+        return _json_response({"error": "Debug sessions endpoint not allowed."}), 403
 
     out = {}
     # If Redis is used, fetch keys from Redis; otherwise use in-memory SESSIONS
     if USE_REDIS and redis_client is not None:
         try:
-            keys = redis_client.keys("session:*")
+            keys = redis_client.keys(_redis_key("*", "meta"))
             for k in keys:
-                sid = k.decode().split(":", 1)[1]
+                sid = k.decode().split(":")[1]
                 raw = redis_client.get(k)
                 try:
-                    sess = pickle.loads(raw) if raw else {}
+                    sess = _load_session(sid, raw) if raw else {}
                 except Exception:
                     sess = {}
-                df = sess.get("dataframe")
-                rows = int(df.shape[0]) if df is not None else 0
                 out[sid] = {
-                    "rows": rows,
+                    "rows": _session_rows(sess),
                     "has_preprocessor": bool(sess.get("preprocessor")),
                     "num_models": len(sess.get("models", {})),
                 }
         except Exception:
             app.logger.exception("Failed to list sessions from Redis")
     else:
-        for sid, sess in SESSIONS.items():
-            df = sess.get("dataframe")
-            rows = int(df.shape[0]) if df is not None else 0
+        with SESSIONS.lock:
+            cached = list(SESSIONS.items())
+        for sid, sess in cached:
             out[sid] = {
-                "rows": rows,
+                "rows": _session_rows(sess),
                 "has_preprocessor": bool(sess.get("preprocessor")),
                 "num_models": len(sess.get("models", {})),
             }
 
-    return jsonify(out)
+    return _json_response(out)
 
 
 if __name__ == "__main__":
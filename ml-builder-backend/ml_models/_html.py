@@ -0,0 +1,29 @@
+# ml_models/_html.py
+from functools import lru_cache
+
+import numpy as np
+
+
+@lru_cache(maxsize=64)
+def _header(n: int) -> str:
+    cells = "".join(f"<th>Pred_{i}</th>" for i in range(n))
+    return (
+        "<table class='confusion-matrix' border='1' cellspacing='0' cellpadding='4'>"
+        f"<thead><tr><th></th>{cells}</tr></thead><tbody>"
+    )
+
+
+def cm_to_html(cm) -> str:
+    """Render a confusion matrix as an HTML table (rows actual, columns predicted).
+
+    Numeric labels 0..n-1 are used since class labels aren't available here.
+    """
+    cm = np.asarray(cm, dtype=np.int64)
+    if cm.size == 0:
+        return ""
+    # one tolist() gives plain ints, so the cells need no per-value coercion
+    body = "".join(
+        f"<tr><th>Actual_{i}</th>" + "".join(f"<td>{v}</td>" for v in row) + "</tr>"
+        for i, row in enumerate(cm.tolist())
+    )
+    return _header(cm.shape[0]) + body + "</tbody></table>"
@@ -1,13 +1,32 @@
 
+import logging
+import os
 from dataclasses import dataclass, asdict
-from typing import Any, Dict, Tuple
+from functools import cached_property
+from typing import Any, Dict, Optional, Tuple
 
+import numpy as np
 import pandas as pd
+from joblib import parallel_backend
+
+# Optionally route sklearn estimators onto Intel oneDAL kernels. This has to run
+# before the sklearn imports below so they pick up the patched classes.
+if os.environ.get("USE_SKLEARNEX", "0") == "1":
+    try:
+        from sklearnex import patch_sklearn
+
+        patch_sklearn()
+    except ImportError:
+        logging.getLogger(__name__).warning(
+            "USE_SKLEARNEX=1 but scikit-learn-intelex is not installed; using stock scikit-learn"
+        )
+
 from sklearn.linear_model import Perceptron
 from sklearn.neural_network import MLPClassifier
 from sklearn.tree import DecisionTreeClassifier
+from sklearn.base import clone
 from sklearn.pipeline import Pipeline
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import ShuffleSplit, StratifiedShuffleSplit
 from sklearn.metrics import (
     accuracy_score,
     precision_score,
@@ -17,6 +36,9 @@ from sklearn.metrics import (
 )
 from sklearn.compose import ColumnTransformer
 
+from ._html import cm_to_html
+from .torch_mlp import TorchMLPClassifier
+
 
 @dataclass
 class TrainResult:
@@ -28,6 +50,11 @@ class TrainResult:
     confusion_matrix: Any
     test_size: float
 
+    @cached_property
+    def confusion_matrix_html(self) -> str:
+        # Computed once per result; to_dict() may be called several times.
+        return cm_to_html(self.confusion_matrix)
+
     def to_dict(self) -> Dict[str, Any]:
         d = asdict(self)
         # Confusion matrix as nested lists (JSON-serializable)
@@ -38,44 +65,54 @@ class TrainResult:
             cm_list = self.confusion_matrix
 
         d["confusion_matrix"] = cm_list
-
-        # Also provide a simple HTML table representation useful for quick frontend
-        # rendering. Rows are actual, columns are predicted. Use numeric labels
-        # 0..n-1 when class labels aren't available.
-        try:
-            n = len(cm_list)
-        except Exception:
-            n = 0
-
-        headers = [f"Pred_{i}" for i in range(n)]
-        rows = []
-        for i in range(n):
-            row_vals = cm_list[i] if i < len(cm_list) else []
-            rows.append(row_vals)
-
-        # build HTML table
-        html = "<table class='confusion-matrix' border='1' cellspacing='0' cellpadding='4'>"
-        # header
-        html += "<thead><tr><th></th>"
-        for h in headers:
-            html += f"<th>{h}</th>"
-        html += "</tr></thead>"
-        # body
-        html += "<tbody>"
-        for i, row in enumerate(rows):
-            html += f"<tr><th>Actual_{i}</th>"
-            for v in row:
-                html += f"<td>{int(v)}</td>"
-            html += "</tr>"
-        html += "</tbody></table>"
-
-        d["confusion_matrix_html"] = html
+        # Also provide a simple HTML table useful for quick frontend rendering.
+        d["confusion_matrix_html"] = self.confusion_matrix_html
         return d
 
 
+def _split_indices(y: np.ndarray, test_size: float, random_state: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Positional train/test indices; stratified when every class has 2+ samples."""
+    _, counts = np.unique(y, return_counts=True)
+    splitter_cls = StratifiedShuffleSplit if counts.min() >= 2 else ShuffleSplit
+    splitter = splitter_cls(n_splits=1, test_size=test_size, random_state=random_state)
+    ((train_idx, test_idx),) = splitter.split(np.zeros(len(y)), y)
+    return train_idx, test_idx
+
+
+def prepare_split(
+    X: pd.DataFrame,
+    y,
+    preprocessor: ColumnTransformer,
+    test_size: float = 0.2,
+    random_state: int = 42,
+) -> Dict[str, Any]:
+    """Split X/y and fit a copy of `preprocessor` on the training rows only.
+
+    The result can be passed to train_and_evaluate for any number of models
+    with the same test_size/random_state, so a hyperparameter sweep fits the
+    preprocessor once without test rows leaking into its statistics.
+    """
+    y = np.asarray(y)
+    train_idx, test_idx = _split_indices(y, test_size, random_state)
+    fitted = clone(preprocessor)
+    # The ColumnTransformer selects columns by name, so X stays a DataFrame
+    X_train = fitted.fit_transform(X.iloc[train_idx], y[train_idx])
+    X_test = fitted.transform(X.iloc[test_idx])
+    return {
+        "test_size": test_size,
+        "random_state": random_state,
+        "preprocessor": fitted,
+        "X_train": X_train,
+        "X_test": X_test,
+        "y_train": y[train_idx],
+        "y_test": y[test_idx],
+    }
+
+
 class BaseClassifierModel:
-    def __init__(self, model_type: str):
+    def __init__(self, model_type: str, n_jobs: int = -1):
         self.model_type = model_type
+        self.n_jobs = n_jobs
         self.pipeline: Pipeline | None = None
 
     def _build_pipeline(self, preprocessor: ColumnTransformer, estimator) -> Pipeline:
@@ -88,16 +125,45 @@ class BaseClassifierModel:
         preprocessor: ColumnTransformer,
         test_size: float = 0.2,
         random_state: int = 42,
+        prepared: Optional[Dict[str, Any]] = None,
     ) -> Tuple[Pipeline, TrainResult]:
+        """Fit and score a pipeline on a (stratified when possible) train/test split.
 
-        X_train, X_test, y_train, y_test = train_test_split(
-            X, y, test_size=test_size, random_state=random_state, stratify=y
-        )
+        If `prepared` (from prepare_split with the same test_size and
+        random_state) is given, only the classifier is fitted; the
+        preprocessor it holds, fitted on the training rows only, is attached
+        to the returned pipeline so it can still be saved as a whole.
+        """
+        estimator = self._build_estimator()
 
-        self.pipeline = self._build_pipeline(preprocessor, self._build_estimator())
+        if prepared is not None:
+            if (prepared["test_size"], prepared["random_state"]) != (test_size, random_state):
+                raise ValueError("prepared split does not match test_size/random_state")
+            y_train, y_test = prepared["y_train"], prepared["y_test"]
+            with parallel_backend("loky", n_jobs=self.n_jobs):
+                estimator.fit(prepared["X_train"], y_train)
+                y_pred = estimator.predict(prepared["X_test"])
+            self.pipeline = self._build_pipeline(prepared["preprocessor"], estimator)
+        else:
+            y = np.asarray(y)
+            train_idx, test_idx = _split_indices(y, test_size, random_state)
+            y_train, y_test = y[train_idx], y[test_idx]
+            # The ColumnTransformer selects columns by name, so X stays a DataFrame
+            X_train, X_test = X.iloc[train_idx], X.iloc[test_idx]
 
-        self.pipeline.fit(X_train, y_train)
-        y_pred = self.pipeline.predict(X_test)
+            self.pipeline = self._build_pipeline(preprocessor, estimator)
+
+            # loky lets the ColumnTransformer and any n_jobs-aware estimator
+            # spread their work across cores.
+            with parallel_backend("loky", n_jobs=self.n_jobs):
+                self.pipeline.fit(X_train, y_train)
+                y_pred = self.pipeline.predict(X_test)
+
+        # n_jobs is this request's worker budget; a saved pipeline shouldn't
+        # carry it, so reset it to joblib's default.
+        self.pipeline.set_params(
+            **{k: None for k in self.pipeline.get_params() if k.split("__")[-1] == "n_jobs"}
+        )
 
         # Use macro-averaging for precision/recall/f1 so they reflect per-class
         # performance instead of matching accuracy (weighted recall equals
@@ -118,17 +184,20 @@ class BaseClassifierModel:
 
 
 class PerceptronModel(BaseClassifierModel):
-    def __init__(self, **kwargs):
-        super().__init__("perceptron")
+    def __init__(self, n_jobs: int = -1, **kwargs):
+        super().__init__("perceptron", n_jobs=n_jobs)
         self.kwargs = kwargs
 
     def _build_estimator(self):
-        return Perceptron(**self.kwargs)
+        # n_jobs parallelizes the one-vs-all fits for multiclass targets
+        params = dict(n_jobs=self.n_jobs)
+        params.update(self.kwargs)
+        return Perceptron(**params)
 
 
 class DecisionTreeModel(BaseClassifierModel):
-    def __init__(self, **kwargs):
-        super().__init__("decision_tree")
+    def __init__(self, n_jobs: int = -1, **kwargs):
+        super().__init__("decision_tree", n_jobs=n_jobs)
         self.kwargs = kwargs
 
     def _build_estimator(self):
@@ -139,11 +208,22 @@ class DecisionTreeModel(BaseClassifierModel):
 
 
 class MLPBackpropModel(BaseClassifierModel):
-    def __init__(self, hidden_layer_sizes=(100,), learning_rate_init=0.001, max_iter=300, **kwargs):
-        super().__init__("multilayer_perceptron")
+    def __init__(
+        self,
+        hidden_layer_sizes=(100,),
+        learning_rate_init=0.001,
+        max_iter=300,
+        n_jobs: int = -1,
+        backend: str = "sklearn",
+        **kwargs,
+    ):
+        super().__init__("multilayer_perceptron", n_jobs=n_jobs)
+        if backend not in ("sklearn", "torch"):
+            raise ValueError("backend must be 'sklearn' or 'torch'")
         self.hidden_layer_sizes = hidden_layer_sizes
         self.learning_rate_init = learning_rate_init
         self.max_iter = max_iter
+        self.backend = backend
         self.kwargs = kwargs
 
     def _build_estimator(self):
@@ -165,6 +245,9 @@ class MLPBackpropModel(BaseClassifierModel):
             params["tol"] = 1e-4
         if "n_iter_no_change" not in self.kwargs:
             params["n_iter_no_change"] = 10
+        if self.backend == "torch":
+            params.update(self.kwargs)
+            return TorchMLPClassifier(**params)
         if "early_stopping" not in self.kwargs:
             params["early_stopping"] = False
         if "verbose" not in self.kwargs:
@@ -1,6 +1,6 @@
 # ml_models/preprocessing.py
 from dataclasses import dataclass
-from typing import List, Tuple
+from typing import List, Optional, Sequence, Tuple
 
 import numpy as np
 import pandas as pd
@@ -28,14 +28,30 @@ class PreprocessorFactory:
     """
 
     @staticmethod
-    def analyze_dataframe(df: pd.DataFrame, target_column: str) -> PreprocessConfig:
+    def split_dtypes(df: pd.DataFrame) -> Tuple[List[str], List[str]]:
+        """Split all columns into (numeric, categorical) in one pass over df.dtypes."""
+        numeric_mask = df.dtypes.apply(
+            lambda t: pd.api.types.is_numeric_dtype(t) and not pd.api.types.is_bool_dtype(t)
+        )
+        numeric = df.columns[numeric_mask.to_numpy(dtype=bool)].tolist()
+        categorical = df.columns[~numeric_mask.to_numpy(dtype=bool)].tolist()
+        return numeric, categorical
+
+    @staticmethod
+    def analyze_dataframe(
+        df: pd.DataFrame,
+        target_column: str,
+        precomputed: Optional[Tuple[Sequence[str], Sequence[str]]] = None,
+    ) -> PreprocessConfig:
+        """`precomputed` is a cached `split_dtypes(df)` result for the same frame."""
         if target_column not in df.columns:
             raise ValueError(f"Target column '{target_column}' not found in dataset.")
 
         feature_columns = [c for c in df.columns if c != target_column]
 
-        numeric_columns = df[feature_columns].select_dtypes(include=[np.number]).columns.tolist()
-        categorical_columns = [c for c in feature_columns if c not in numeric_columns]
+        numeric, categorical = precomputed if precomputed is not None else PreprocessorFactory.split_dtypes(df)
+        numeric_columns = [c for c in numeric if c != target_column]
+        categorical_columns = [c for c in categorical if c != target_column]
 
         return PreprocessConfig(
             method="",
@@ -46,7 +62,9 @@ class PreprocessorFactory:
         )
 
     @staticmethod
-    def build(config: PreprocessConfig, method: str) -> Tuple[ColumnTransformer, PreprocessConfig]:
+    def build(
+        config: PreprocessConfig, method: str, n_jobs: Optional[int] = -1
+    ) -> Tuple[ColumnTransformer, PreprocessConfig]:
         method = method.lower()
         if method not in ("normalization", "onehot"):
             raise ValueError("method must be 'normalization' or 'onehot'")
@@ -55,11 +73,12 @@ class PreprocessorFactory:
 
         # Pipelines for numeric and categorical features
         if method == "normalization":
-            # numeric: impute + scale
+            # numeric: impute + scale. with_mean=False skips centering so the
+            # stacked output can stay sparse next to the one-hot columns.
             num_pipeline = Pipeline(
                 steps=[
                     ("imputer", SimpleImputer(strategy="median")),
-                    ("scaler", StandardScaler()),
+                    ("scaler", StandardScaler(with_mean=False)),
                 ]
             )
         else:  # "onehot"
@@ -73,7 +92,7 @@ class PreprocessorFactory:
         cat_pipeline = Pipeline(
             steps=[
                 ("imputer", SimpleImputer(strategy="most_frequent")),
-                ("encoder", OneHotEncoder(handle_unknown="ignore")),
+                ("encoder", OneHotEncoder(handle_unknown="ignore", sparse_output=True, dtype=np.float32)),
             ]
         )
 
@@ -86,6 +105,7 @@ class PreprocessorFactory:
         if not transformers:
             raise ValueError("No usable features found (no numeric or categorical columns).")
 
-        preprocessor = ColumnTransformer(transformers=transformers)
+        # n_jobs fits the numeric and categorical branches in parallel
+        preprocessor = ColumnTransformer(transformers=transformers, n_jobs=n_jobs, sparse_threshold=0.3)
 
         return preprocessor, config
@@ -0,0 +1,101 @@
+# ml_models/torch_mlp.py
+"""PyTorch-backed MLP with the scikit-learn estimator interface.
+
+Used by MLPBackpropModel(backend="torch") so the dense matrix multiplies run
+on the GPU when one is available. torch is imported lazily; it is only
+required when this backend is selected.
+"""
+import numpy as np
+from scipy import sparse
+from sklearn.base import BaseEstimator, ClassifierMixin
+
+
+def _to_dense(X) -> np.ndarray:
+    return X.toarray() if sparse.issparse(X) else np.asarray(X)
+
+
+class TorchMLPClassifier(ClassifierMixin, BaseEstimator):
+    def __init__(
+        self,
+        hidden_layer_sizes=(100,),
+        learning_rate_init=0.001,
+        max_iter=300,
+        batch_size=200,
+        tol=1e-4,
+        n_iter_no_change=10,
+        random_state=None,
+        device=None,
+    ):
+        self.hidden_layer_sizes = hidden_layer_sizes
+        self.learning_rate_init = learning_rate_init
+        self.max_iter = max_iter
+        self.batch_size = batch_size
+        self.tol = tol
+        self.n_iter_no_change = n_iter_no_change
+        self.random_state = random_state
+        self.device = device
+
+    def fit(self, X, y):
+        import torch
+        from torch import nn
+
+        device = self.device or ("cuda" if torch.cuda.is_available() else "cpu")
+        if self.random_state is not None:
+            torch.manual_seed(self.random_state)
+
+        self.classes_, y_idx = np.unique(np.asarray(y), return_inverse=True)
+        X_t = torch.as_tensor(_to_dense(X), dtype=torch.float32, device=device)
+        y_t = torch.as_tensor(y_idx, dtype=torch.long, device=device)
+
+        layers = []
+        in_features = X_t.shape[1]
+        for width in self.hidden_layer_sizes:
+            layers += [nn.Linear(in_features, int(width)), nn.ReLU()]
+            in_features = int(width)
+        layers.append(nn.Linear(in_features, len(self.classes_)))
+        model = nn.Sequential(*layers).to(device)
+
+        optimizer = torch.optim.Adam(model.parameters(), lr=self.learning_rate_init)
+        loss_fn = nn.CrossEntropyLoss()
+
+        n = X_t.shape[0]
+        batch = max(1, min(int(self.batch_size), n))
+        best_loss = np.inf
+        no_improve = 0
+        self.n_iter_ = 0
+        for _ in range(int(self.max_iter)):
+            perm = torch.randperm(n, device=device)
+            # accumulate on-device; one host sync per epoch instead of per batch
+            total = torch.zeros((), device=device)
+            for start in range(0, n, batch):
+                idx = perm[start:start + batch]
+                optimizer.zero_grad()
+                loss = loss_fn(model(X_t[idx]), y_t[idx])
+                loss.backward()
+                optimizer.step()
+                total += loss.detach() * len(idx)
+            self.n_iter_ += 1
+
+            # same stopping rule as sklearn's MLPClassifier (training loss)
+            epoch_loss = total.item() / n
+            if epoch_loss > best_loss - self.tol:
+                no_improve += 1
+                if no_improve >= self.n_iter_no_change:
+                    break
+            else:
+                no_improve = 0
+            best_loss = min(best_loss, epoch_loss)
+
+        # keep the fitted network on CPU so the pipeline can be pickled/saved
+        self.model_ = model.cpu().eval()
+        return self
+
+    def predict_proba(self, X):
+        import torch
+
+        with torch.no_grad():
+            logits = self.model_(torch.as_tensor(_to_dense(X), dtype=torch.float32))
+            return torch.softmax(logits, dim=1).numpy()
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]